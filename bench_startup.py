@@ -0,0 +1,72 @@
+"""Benchmark du démarrage à froid de projet.py : temps jusqu'au premier rendu.
+
+Chaque mesure lance un interpréteur neuf (comme un worker autoscalé qui démarre),
+exécute l'application avec streamlit.testing.v1.AppTest et chronomètre le premier
+rendu complet avec les widgets par défaut, dans chaque mode EV_STARTUP_MODE.
+Le fichier de télémétrie doit se trouver dans le répertoire --cwd.
+
+    python bench_startup.py [--runs 5] [--cwd .]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'projet.py')
+HEAVY_MODULES = ['folium', 'streamlit_folium', 'plotly']
+
+# Les modules lourds importés pendant le rendu sont relevés par un audit hook ;
+# les imports du thread de préchargement (démarré en fin de rendu) sont ignorés
+CHILD = f"""
+import json, sys, threading, time
+loaded = set()
+def hook(event, args):
+    if event == 'import' and threading.current_thread().name != 'prewarm':
+        top = args[0].split('.')[0]
+        if top in {HEAVY_MODULES!r}:
+            loaded.add(top)
+sys.addaudithook(hook)
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t_harness = time.perf_counter() - t0
+at = AppTest.from_file({APP!r}, default_timeout=300)
+t1 = time.perf_counter()
+at.run()
+t_render = time.perf_counter() - t1
+if at.exception:
+    sys.exit('exception: ' + str(at.exception[0].message))
+print(json.dumps({{'harness': t_harness, 'render': t_render, 'loaded': sorted(loaded)}}))
+"""
+
+def measure(mode, cwd):
+    env = dict(os.environ, EV_STARTUP_MODE=mode)
+    out = subprocess.run([sys.executable, '-c', CHILD], capture_output=True, text=True,
+                         check=True, cwd=cwd, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--cwd', default='.', help="répertoire contenant le CSV de télémétrie")
+    args = parser.parse_args()
+
+    # Un premier passage non mesuré remplit les caches disque (.pyc, pyramide, pages OS)
+    measure('eager', args.cwd)
+
+    results = {}
+    for mode in ('eager', 'lazy'):
+        runs = [measure(mode, args.cwd) for _ in range(args.runs)]
+        timings = [r['render'] for r in runs]
+        results[mode] = statistics.median(timings)
+        print(f"{mode:>5}: premier rendu médian {results[mode] * 1000:7.1f} ms "
+              f"(min {min(timings) * 1000:.1f}, max {max(timings) * 1000:.1f}, {args.runs} runs) "
+              f"| chargés : {', '.join(runs[-1]['loaded']) or 'aucun'}")
+
+    gain = results['eager'] - results['lazy']
+    print(f" gain: {gain * 1000:7.1f} ms ({gain / results['eager']:.0%}) "
+          f"[import du harnais AppTest exclu]")
+
+if __name__ == "__main__":
+    main()
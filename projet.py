@@ -1,13 +1,19 @@
+import os
+import json
+import hashlib
+import time
+import threading
+import xml.etree.ElementTree as ET
 import pandas as pd
 import numpy as np
 import streamlit as st
-import folium
-from streamlit_folium import folium_static
-from folium.plugins import HeatMap, AntPath
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime
 
+# folium et Plotly sont importés dans les panneaux qui les utilisent.
+# EV_STARTUP_MODE=lazy (défaut) : préchargement en arrière-plan après le premier rendu
+# EV_STARTUP_MODE=eager : tout est importé avant le premier rendu
+STARTUP_MODE = os.environ.get('EV_STARTUP_MODE', 'lazy')
+
 # Configuration moderne de la page
 st.set_page_config(
     page_title="🚗 EV Telemetry Analytics",
@@ -60,11 +66,42 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+def _prewarm_heavy_modules():
+    import folium
+    import folium.plugins
+    import streamlit_folium
+    import plotly.graph_objects
+    import plotly.subplots
+    import plotly.io as pio
+    # Les templates Plotly sont chargés à la première utilisation
+    pio.templates['plotly_dark']
+
+@st.cache_resource
+def start_background_prewarm():
+    # Un seul thread par processus (cache_resource est partagé entre sessions)
+    thread = threading.Thread(target=_prewarm_heavy_modules, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+if STARTUP_MODE == 'eager':
+    _prewarm_heavy_modules()
+
+# Fichiers du map-matching (graphe routier hors ligne, ex. extrait OSM de Lille)
+DATA_FILE = '7_l2ep_leaf.ppc_2025_02_07_14_41_42 pn.csv'
+ROAD_GRAPH_FILE = os.environ.get('EV_ROAD_GRAPH', 'lille.osm')
+SEGMENT_INDEX_FILE = os.environ.get('EV_SEGMENT_INDEX', 'road_segment_index.csv')
+SNAP_DISTANCE_M = 30.0   # Distance max entre un point GPS et sa route
+MAX_SAMPLE_GAP_S = 5.0   # Au-delà, l'intervalle n'est pas compté (trou d'enregistrement)
+
+def has_gps_fix(df):
+    # Lignes sans position GPS (0, 0) ignorées par tout le tableau de bord
+    return (df['GPSLat'] != 0) & (df['GPSLon'] != 0)
+
 @st.cache_data
 def load_data():
-    df = pd.read_csv('7_l2ep_leaf.ppc_2025_02_07_14_41_42 pn.csv')
+    df = pd.read_csv(DATA_FILE)
     df['Timestamp'] = pd.to_datetime(df['Time'], unit='s', origin=datetime.now())
-    df = df[(df['GPSLat'] != 0) & (df['GPSLon'] != 0)]
+    df = df[has_gps_fix(df)]
     
     # Calcul de métriques supplémentaires
     df['Energy_Consumption'] = df['HVBVoltage'] * df['MotTorque'] / 1000
@@ -72,6 +109,431 @@ def load_data():
     
     return df
 
+# Pyramide de décimation stockée avec la session (du plus fin au plus grossier)
+PYRAMID_RATES_HZ = (1.0, 0.1, 0.01)
+EXPORT_RATES_HZ = (10.0,) + PYRAMID_RATES_HZ
+CHART_MAX_POINTS = 2000     # ~ largeur d'écran : au-delà, les points se superposent
+
+def resample_channels(df, rate_hz, channels=None):
+    # Aligne les canaux sur une grille fixe à rate_hz (temps = centre des intervalles).
+    # Chaque canal n'utilise que ses propres échantillons : un canal échantillonné plus
+    # vite que la grille est moyenné par intervalle, un canal plus lent est interpolé
+    # linéairement aux instants de la grille. Les points de grille à plus d'une période
+    # native de tout échantillon (trous d'enregistrement) restent à NaN.
+    if channels is None:
+        channels = [c for c in df.select_dtypes(include='number').columns if c != 'Time']
+    if df.empty:
+        return pd.DataFrame(columns=['Time'] + list(channels), dtype=float)
+    t = df['Time'].to_numpy(dtype=float)
+    t0 = np.floor(t.min() * rate_hz) / rate_hz
+    n_bins = int(np.floor((t.max() - t0) * rate_hz)) + 1
+    grid = t0 + (np.arange(n_bins) + 0.5) / rate_hz
+    bins = np.minimum(((t - t0) * rate_hz).astype(np.int64), n_bins - 1)
+
+    out = {'Time': grid}
+    for col in channels:
+        values = df[col].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            out[col] = np.full(n_bins, np.nan)
+            continue
+        tv = t[valid]
+        resampled = np.interp(grid, tv, values[valid])
+        # Période native : médiane des pas, insensible aux trous
+        steps = np.diff(tv)
+        steps = steps[steps > 0]
+        period = np.median(steps) if len(steps) else 1.0 / rate_hz
+        filled = np.zeros(n_bins, dtype=bool)
+        if 1.0 / period > rate_hz:
+            counts = np.bincount(bins[valid], minlength=n_bins)
+            sums = np.bincount(bins[valid], weights=values[valid], minlength=n_bins)
+            filled = counts > 0
+            resampled[filled] = sums[filled] / counts[filled]
+        # Distance de chaque point de grille à l'échantillon réel le plus proche
+        idx = np.searchsorted(tv, grid)
+        before = tv[np.maximum(idx - 1, 0)]
+        after = tv[np.minimum(idx, len(tv) - 1)]
+        nearest = np.minimum(np.abs(grid - before), np.abs(after - grid))
+        resampled[~filled & (nearest > period)] = np.nan
+        out[col] = resampled
+    return pd.DataFrame(out)
+
+@st.cache_data(persist="disk")
+def build_pyramid(df, rates=PYRAMID_RATES_HZ):
+    # Chaque niveau est calculé depuis les données brutes (pas d'erreur cumulée)
+    return {rate: resample_channels(df, rate) for rate in rates}
+
+def select_level(pyramid, raw_df, time_range, max_points):
+    # Niveau le plus grossier offrant au moins max_points sur la plage, sinon le brut
+    for rate in sorted(pyramid):
+        level = pyramid[rate]
+        level = level[(level['Time'] >= time_range[0]) & (level['Time'] <= time_range[1])]
+        if len(level) >= max_points:
+            return level
+    return raw_df
+
+@st.cache_data(max_entries=4)
+def build_export_csv(rate_hz, time_range):
+    # Export de la plage choisie, brut (rate_hz=None) ou aligné sur une grille fixe
+    df = load_data()
+    if rate_hz is None:
+        export_df = df[(df['Time'] >= time_range[0]) & (df['Time'] <= time_range[1])]
+    elif rate_hz in PYRAMID_RATES_HZ:
+        level = build_pyramid(df)[rate_hz]
+        export_df = level[(level['Time'] >= time_range[0]) & (level['Time'] <= time_range[1])]
+    else:
+        export_df = resample_channels(df[(df['Time'] >= time_range[0]) & (df['Time'] <= time_range[1])], rate_hz)
+    return export_df.to_csv(index=False)
+
+def _to_local_meters(lat, lon, lat0, lon0):
+    # Projection équirectangulaire locale, suffisante à l'échelle d'une ville
+    x = (np.asarray(lon) - lon0) * 111320.0 * np.cos(np.radians(lat0))
+    y = (np.asarray(lat) - lat0) * 110540.0
+    return x, y
+
+@st.cache_data
+def load_road_graph(path, bbox, margin=0.01):
+    # Charge les segments routiers d'un fichier OSM (.osm) dans la bbox donnée
+    lat_min, lon_min, lat_max, lon_max = bbox
+    lat_min, lon_min = lat_min - margin, lon_min - margin
+    lat_max, lon_max = lat_max + margin, lon_max + margin
+
+    nodes = {}
+    segments = []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            lat, lon = float(elem.get('lat')), float(elem.get('lon'))
+            if lat_min <= lat <= lat_max and lon_min <= lon <= lon_max:
+                nodes[elem.get('id')] = (lat, lon)
+            elem.clear()
+        elif elem.tag == 'way':
+            tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+            if 'highway' in tags:
+                way_id = elem.get('id')
+                refs = [nd.get('ref') for nd in elem.findall('nd')]
+                for k, (a, b) in enumerate(zip(refs[:-1], refs[1:])):
+                    if a in nodes and b in nodes:
+                        segments.append({
+                            'segment_id': f"{way_id}:{k}",
+                            'name': tags.get('name', ''),
+                            'lat1': nodes[a][0], 'lon1': nodes[a][1],
+                            'lat2': nodes[b][0], 'lon2': nodes[b][1],
+                        })
+            elem.clear()
+
+    return pd.DataFrame(segments, columns=['segment_id', 'name', 'lat1', 'lon1', 'lat2', 'lon2'])
+
+def match_to_roads(df, graph, max_distance=SNAP_DISTANCE_M):
+    # Associe chaque point GPS au segment routier le plus proche (ou None)
+    matched = pd.Series(None, index=df.index, dtype=object)
+    if graph.empty or df.empty:
+        return matched
+
+    lat0, lon0 = df['GPSLat'].mean(), df['GPSLon'].mean()
+    px, py = _to_local_meters(df['GPSLat'].values, df['GPSLon'].values, lat0, lon0)
+    ax, ay = _to_local_meters(graph['lat1'].values, graph['lon1'].values, lat0, lon0)
+    bx, by = _to_local_meters(graph['lat2'].values, graph['lon2'].values, lat0, lon0)
+
+    # Index spatial par grille : chaque segment est inscrit dans les cellules
+    # couvertes par sa bbox élargie de la distance de snap
+    cell = max_distance
+    grid = {}
+    x_lo = np.floor((np.minimum(ax, bx) - max_distance) / cell).astype(int)
+    x_hi = np.floor((np.maximum(ax, bx) + max_distance) / cell).astype(int)
+    y_lo = np.floor((np.minimum(ay, by) - max_distance) / cell).astype(int)
+    y_hi = np.floor((np.maximum(ay, by) + max_distance) / cell).astype(int)
+    for s in range(len(graph)):
+        for cx in range(x_lo[s], x_hi[s] + 1):
+            for cy in range(y_lo[s], y_hi[s] + 1):
+                grid.setdefault((cx, cy), []).append(s)
+
+    # Traitement vectorisé par cellule : points x segments candidats
+    pcx = np.floor(px / cell).astype(int)
+    pcy = np.floor(py / cell).astype(int)
+    # Regroupement des points par cellule en un seul tri (clé de cellule entière)
+    cy_min, cy_span = pcy.min(), pcy.max() - pcy.min() + 1
+    codes = pcx.astype(np.int64) * cy_span + (pcy - cy_min)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    result = np.full(len(df), -1)
+    for pts in np.split(order, starts[1:]):
+        cx, cy = pcx[pts[0]], pcy[pts[0]]
+        candidates = grid.get((cx, cy))
+        if not candidates:
+            continue
+        cand = np.asarray(candidates)
+        dx, dy = bx[cand] - ax[cand], by[cand] - ay[cand]
+        length2 = np.maximum(dx * dx + dy * dy, 1e-9)
+        t = ((px[pts, None] - ax[cand]) * dx + (py[pts, None] - ay[cand]) * dy) / length2
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(ax[cand] + t * dx - px[pts, None], ay[cand] + t * dy - py[pts, None])
+        best = dist.argmin(axis=1)
+        ok = dist[np.arange(len(pts)), best] <= max_distance
+        result[pts[ok]] = cand[best[ok]]
+
+    snapped = result >= 0
+    matched.iloc[np.flatnonzero(snapped)] = graph['segment_id'].values[result[snapped]]
+    return matched
+
+def aggregate_by_segment(df, matched, graph, session_id):
+    # Agrège vitesse, température, énergie et distance par segment pour une session
+    # Incréments par échantillon (intervalle i -> i+1), ignorés sur les trous
+    dt = df['Time'].diff().shift(-1).fillna(0)
+    valid = (dt > 0) & (dt <= MAX_SAMPLE_GAP_S)
+    dist_km = df['VehDistance'].diff().shift(-1).fillna(0).clip(lower=0).where(valid, 0)
+    if 'HVBCurrent' in df.columns:
+        energy_wh = (df['HVBVoltage'] * df['HVBCurrent'] * dt / 3600).where(valid, 0)
+    else:
+        energy_wh = pd.Series(np.nan, index=df.index)
+
+    samples = pd.DataFrame({
+        'segment_id': matched,
+        'speed': df['VehSpeed'],
+        'temp': df['HVBTemp'],
+        'energy_wh': energy_wh,
+        'distance_km': dist_km,
+    }).dropna(subset=['segment_id'])
+
+    stats = samples.groupby('segment_id').agg(
+        n=('speed', 'size'),
+        speed_sum=('speed', 'sum'),
+        temp_sum=('temp', 'sum'),
+        energy_wh=('energy_wh', lambda e: e.sum(min_count=1)),
+        distance_km=('distance_km', 'sum'),
+    ).reset_index()
+    stats.insert(1, 'session', session_id)
+    geometry = graph[['segment_id', 'name', 'lat1', 'lon1', 'lat2', 'lon2']]
+    return stats.merge(geometry, on='segment_id', how='left')
+
+def update_segment_index(index_path, session_stats):
+    # Remplace les lignes de la session dans l'index et réécrit le fichier
+    if os.path.exists(index_path):
+        index = pd.read_csv(index_path, dtype={'segment_id': str, 'session': str})
+        sessions = set(session_stats['session'])
+        index = pd.concat([index[~index['session'].isin(sessions)], session_stats], ignore_index=True)
+    else:
+        index = session_stats
+    index.to_csv(index_path, index=False)
+    return index
+
+def summarize_segment_index(index):
+    # Moyennes par segment sur l'ensemble des sessions indexées
+    summary = index.groupby('segment_id').agg(
+        name=('name', 'first'),
+        lat1=('lat1', 'first'), lon1=('lon1', 'first'),
+        lat2=('lat2', 'first'), lon2=('lon2', 'first'),
+        sessions=('session', 'nunique'),
+        n=('n', 'sum'),
+        speed_sum=('speed_sum', 'sum'),
+        temp_sum=('temp_sum', 'sum'),
+        energy_wh=('energy_wh', lambda e: e.sum(min_count=1)),
+        distance_km=('distance_km', 'sum'),
+    ).reset_index()
+    summary['name'] = summary['name'].fillna('')
+    summary['mean_speed'] = summary['speed_sum'] / summary['n']
+    summary['mean_temp'] = summary['temp_sum'] / summary['n']
+    summary['wh_per_km'] = (summary['energy_wh'] / summary['distance_km']).where(summary['distance_km'] > 0.001)
+    return summary.drop(columns=['speed_sum', 'temp_sum'])
+
+@st.cache_data
+def build_road_segment_index(df, session_id):
+    bbox = (df['GPSLat'].min(), df['GPSLon'].min(), df['GPSLat'].max(), df['GPSLon'].max())
+    graph = load_road_graph(ROAD_GRAPH_FILE, bbox)
+    matched = match_to_roads(df, graph)
+    session_stats = aggregate_by_segment(df, matched, graph, session_id)
+    index = update_segment_index(SEGMENT_INDEX_FILE, session_stats)
+    return summarize_segment_index(index)
+
+def speed_color(speed):
+    # Couleur basée sur la vitesse
+    if speed < 20:
+        return '#00ff00'  # Vert
+    elif speed < 40:
+        return '#7fff00'  # Vert-jaune
+    elif speed < 60:
+        return '#ffff00'  # Jaune
+    elif speed < 80:
+        return '#ff8c00'  # Orange
+    return '#ff0000'  # Rouge
+
+# Seuils d'alerte partagés avec les métriques de synthèse
+TEMP_ALERT_C = 45.0
+CONSUMPTION_ALERT_PCT_KM = 1.0   # %SOC consommé par km (ΔSOC / Δdistance)
+ALERT_LOG_FILE = os.environ.get('EV_ALERT_LOG', 'alerts_log.jsonl')
+ALERT_CHUNK_SIZE = 10000
+
+# Règles par défaut (fenêtres glissantes exprimées en nombre d'échantillons)
+DEFAULT_ALERT_RULES = [
+    {'id': 'temp_high', 'type': 'threshold', 'channel': 'HVBTemp', 'op': '>', 'limit': TEMP_ALERT_C,
+     'label': '🌡️ Température batterie élevée', 'severity': 'error'},
+    {'id': 'consumption_high', 'type': 'consumption', 'channel': 'HVBSOC', 'distance': 'VehDistance',
+     'window': 500, 'min_km': 0.2, 'limit': CONSUMPTION_ALERT_PCT_KM,
+     'label': '⚡ Consommation élevée', 'severity': 'warning'},
+    {'id': 'current_spike', 'type': 'zscore', 'channel': 'HVBCurrent', 'window': 200, 'z': 4.0,
+     'label': '📈 Pic de courant anormal', 'severity': 'warning'},
+    {'id': 'temp_rise', 'type': 'rate', 'channel': 'HVBTemp', 'window': 3000, 'max_rate': 0.03,
+     'label': '🔥 Échauffement rapide (°C/s)', 'severity': 'warning'},
+    {'id': 'voltage_sag', 'type': 'sag', 'channel': 'HVBVoltage', 'load': 'MotTorque', 'load_min': 100.0,
+     'window': 200, 'drop': 15.0, 'label': '🔻 Chute de tension sous charge', 'severity': 'error'},
+]
+
+def _rule_channels(rule):
+    return [rule['channel']] + [rule[k] for k in ('distance', 'load') if k in rule]
+
+def _rolling_mean_std(x, window):
+    # Moyenne/écart-type des `window` échantillons précédant chaque indice (sommes cumulées)
+    cs = np.concatenate([[0.0], np.cumsum(x)])
+    cs2 = np.concatenate([[0.0], np.cumsum(x * x)])
+    mean = np.full(len(x), np.nan)
+    std = np.full(len(x), np.nan)
+    if len(x) > window:
+        s = cs[window:-1] - cs[:-window - 1]
+        s2 = cs2[window:-1] - cs2[:-window - 1]
+        mean[window:] = s / window
+        std[window:] = np.sqrt(np.maximum(s2 / window - mean[window:] ** 2, 0.0))
+    return mean, std
+
+def _evaluate_rule(rule, t, cols):
+    # Condition d'alerte et valeur observée pour chaque échantillon (historique inclus)
+    x = cols[rule['channel']]
+    kind = rule['type']
+    if kind == 'threshold':
+        cond = x > rule['limit'] if rule['op'] == '>' else x < rule['limit']
+        return cond, x
+    if kind == 'rate':
+        # Pente sur `window` échantillons : insensible au bruit et à la quantification
+        w = rule['window']
+        rate = np.full(len(x), np.nan)
+        if len(x) > w:
+            dt = t[w:] - t[:-w]
+            rate[w:] = np.where(dt > 0, (x[w:] - x[:-w]) / np.where(dt > 0, dt, 1.0), np.nan)
+        return rate > rule['max_rate'], rate
+    if kind == 'zscore':
+        mean, std = _rolling_mean_std(x, rule['window'])
+        z = (x - mean) / np.where(std > 1e-9, std, np.nan)
+        return np.abs(z) > rule['z'], z
+    if kind == 'sag':
+        baseline, _ = _rolling_mean_std(x, rule['window'])
+        sag = baseline - x
+        return (cols[rule['load']] > rule['load_min']) & (sag > rule['drop']), sag
+    if kind == 'consumption':
+        w, d = rule['window'], cols[rule['distance']]
+        consumption = np.full(len(x), np.nan)
+        if len(x) > w:
+            dist = d[w:] - d[:-w]
+            consumption[w:] = np.where(dist > rule['min_km'], (x[:-w] - x[w:]) / np.maximum(dist, 1e-9), np.nan)
+        return consumption > rule['limit'], consumption
+    raise ValueError(f"Type de règle inconnu : {kind}")
+
+def init_alert_state(rules):
+    return {rule['id']: {'rule': rule, 'tail': None, 'active': False} for rule in rules}
+
+def process_chunk(state, chunk):
+    # Évalue un bloc de télémétrie. Chaque règle ne conserve que les `window`
+    # derniers échantillons du bloc précédent : travail O(1) par échantillon.
+    alerts = []
+    for rule_state in state.values():
+        rule = rule_state['rule']
+        names = _rule_channels(rule)
+        if any(name not in chunk.columns for name in names):
+            continue
+        t = chunk['Time'].to_numpy(dtype=float)
+        cols = {name: chunk[name].to_numpy(dtype=float) for name in names}
+        tail = rule_state['tail']
+        n_tail = 0
+        if tail is not None:
+            n_tail = len(tail['Time'])
+            t = np.concatenate([tail['Time'], t])
+            cols = {name: np.concatenate([tail[name], cols[name]]) for name in names}
+
+        cond, value = _evaluate_rule(rule, t, cols)
+        cond, value = cond[n_tail:], value[n_tail:]
+
+        # Déclenchement sur front montant uniquement (pas une alerte par échantillon)
+        previous = np.concatenate([[rule_state['active']], cond[:-1]])
+        for i in np.flatnonzero(cond & ~previous):
+            alerts.append({
+                'time': float(t[n_tail + i]),
+                'rule': rule['id'],
+                'label': rule['label'],
+                'severity': rule['severity'],
+                'channel': rule['channel'],
+                'value': float(value[i]),
+            })
+        if len(cond):
+            rule_state['active'] = bool(cond[-1])
+
+        keep = max(rule.get('window', 1), 1)
+        rule_state['tail'] = {'Time': t[-keep:], **{name: cols[name][-keep:] for name in names}}
+    return alerts
+
+def run_alert_engine(chunks, rules):
+    # Rejoue un flux de blocs (ex. pd.read_csv(..., chunksize=...)) dans le moteur
+    state = init_alert_state(rules)
+    alerts = []
+    samples = 0
+    t_first = t_last = None
+    started = time.perf_counter()
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        alerts.extend(process_chunk(state, chunk))
+        samples += len(chunk)
+        t_first = chunk['Time'].iloc[0] if t_first is None else t_first
+        t_last = chunk['Time'].iloc[-1]
+    elapsed = time.perf_counter() - started
+
+    replay = {
+        'samples': samples,
+        'elapsed_s': elapsed,
+        'realtime_factor': (t_last - t_first) / elapsed if samples and elapsed > 0 else float('nan'),
+    }
+    columns = ['time', 'rule', 'label', 'severity', 'channel', 'value']
+    return pd.DataFrame(alerts, columns=columns), replay
+
+def _read_alert_log(path):
+    # Entrées valides du journal (lignes vides ou corrompues ignorées)
+    entries = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return entries
+
+def update_alert_log(alerts, session_id, ruleset, path=ALERT_LOG_FILE):
+    # Remplace les entrées (session, jeu de règles) du journal, comme update_segment_index.
+    # Des seuils différents produisent des entrées distinctes au lieu de s'écraser.
+    with _alert_log_lock():
+        kept = [e for e in _read_alert_log(path)
+                if (e.get('session'), e.get('ruleset')) != (session_id, ruleset)]
+        records = [{'session': session_id, 'ruleset': ruleset, **r} for r in alerts.to_dict('records')]
+        # Écriture atomique : fichier temporaire puis os.replace
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as log:
+            for entry in kept + records:
+                log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+@st.cache_resource
+def _alert_log_lock():
+    # Verrou partagé par toutes les sessions du processus
+    return threading.Lock()
+
+@st.cache_resource
+def _alert_log_versions():
+    # Couples (session, jeu de règles, mtime) déjà journalisés par ce processus
+    return set()
+
+@st.cache_data
+def replay_session_alerts(path, mtime, rules):
+    # Lecture incrémentale du fichier : chaque bloc est évalué dès qu'il est lu.
+    # mtime fait partie de la clé de cache pour suivre les réécritures du fichier.
+    chunks = (chunk[has_gps_fix(chunk)] for chunk in pd.read_csv(path, chunksize=ALERT_CHUNK_SIZE))
+    return run_alert_engine(chunks, rules)
+
 def create_sidebar(df):
     with st.sidebar:
         st.markdown("### 🎛️ Panneau de Contrôle")
@@ -111,7 +573,61 @@ def create_sidebar(df):
             help="Choisissez le niveau de détail"
         )
         
-    return time_range, selected_params, view_mode
+        # Carte masquée par défaut : folium et le map-matching ne sont chargés
+        # qu'à l'ouverture de la carte
+        show_map = st.checkbox(
+            "🗺️ Afficher la carte",
+            value=False,
+            help="La carte charge folium et lance le map-matching"
+        )
+        show_stats = st.checkbox(
+            "📊 Analyse statistique",
+            value=True,
+            help="Tableau descriptif, distributions et matrice de corrélation"
+        )
+        
+    return time_range, selected_params, view_mode, show_map, show_stats
+
+def render_alert_panel(time_range):
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("### 🚨 Alertes")
+        
+        # Seuils configurables (chaque modification relance le rejeu)
+        with st.expander("⚙️ Seuils d'alerte"):
+            overrides = {
+                'temp_high': {'limit': st.number_input("Température max (°C)", value=TEMP_ALERT_C, step=1.0)},
+                'consumption_high': {'limit': st.number_input("Consommation max (%/km)", value=CONSUMPTION_ALERT_PCT_KM, step=0.1)},
+                'current_spike': {'z': st.number_input("Z-score courant", value=4.0, step=0.5)},
+                'voltage_sag': {'drop': st.number_input("Chute de tension (V)", value=15.0, step=1.0)},
+            }
+        rules = [{**rule, **overrides.get(rule['id'], {})} for rule in DEFAULT_ALERT_RULES]
+        
+        alerts, replay = replay_session_alerts(DATA_FILE, os.path.getmtime(DATA_FILE), rules)
+        
+        # Journal réécrit uniquement pour un nouveau jeu de règles ou fichier
+        session_id = os.path.basename(DATA_FILE)
+        ruleset = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+        log_key = (session_id, ruleset, os.path.getmtime(DATA_FILE))
+        if log_key not in _alert_log_versions():
+            update_alert_log(alerts, session_id, ruleset)
+            _alert_log_versions().add(log_key)
+        visible = alerts[(alerts['time'] >= time_range[0]) & (alerts['time'] <= time_range[1])]
+        
+        st.caption(
+            f"{replay['samples']} échantillons rejoués en {replay['elapsed_s'] * 1000:.0f} ms "
+            f"(×{replay['realtime_factor']:.0f} temps réel)"
+        )
+        if visible.empty:
+            st.success("✅ Aucune alerte sur la période")
+        else:
+            st.markdown(f"**{len(visible)} alerte(s) sur la période**")
+            for alert in visible.tail(10).itertuples(index=False):
+                message = f"{alert.label} — t={alert.time:.0f}s ({alert.value:.2f})"
+                if alert.severity == 'error':
+                    st.error(message)
+                else:
+                    st.warning(message)
 
 def render_hero_metrics(df):
     st.markdown("### 📈 Vue d'ensemble de la session")
@@ -135,8 +651,8 @@ def render_hero_metrics(df):
         st.metric(
             "🌡️ Temp Max",
             f"{df['HVBTemp'].max():.1f}°C",
-            delta="Optimal" if df['HVBTemp'].max() < 45 else "Élevée",
-            delta_color="normal" if df['HVBTemp'].max() < 45 else "inverse"
+            delta="Optimal" if df['HVBTemp'].max() < TEMP_ALERT_C else "Élevée",
+            delta_color="normal" if df['HVBTemp'].max() < TEMP_ALERT_C else "inverse"
         )
     
     with col4:
@@ -150,19 +666,23 @@ def render_hero_metrics(df):
     with col5:
         energy_used = (df['HVBSOC'].iloc[0] - df['HVBSOC'].iloc[-1])
         if distance > 0:
-            consumption = (energy_used / distance) * 100
+            consumption = energy_used / distance
             st.metric(
                 "⚡ Consommation",
-                f"{consumption:.1f} %/km",
-                delta="Économique" if consumption < 15 else "Élevée",
-                delta_color="normal" if consumption < 15 else "inverse"
+                f"{consumption:.2f} %/km",
+                delta="Économique" if consumption < CONSUMPTION_ALERT_PCT_KM else "Élevée",
+                delta_color="normal" if consumption < CONSUMPTION_ALERT_PCT_KM else "inverse"
             )
 
-def render_interactive_map(df):
+def render_interactive_map(df, segment_index=None):
+    import folium
+    from streamlit_folium import folium_static
+    from folium.plugins import HeatMap, AntPath
+    
     st.markdown("### 🗺️ Trajectoire du Véhicule")
     
     # Options de personnalisation de la carte
-    col_controls = st.columns([2, 1, 1, 1])
+    col_controls = st.columns([2, 1, 1, 1, 1])
     with col_controls[0]:
         map_style = st.selectbox(
             "Style de carte",
@@ -175,6 +695,13 @@ def render_interactive_map(df):
         show_markers = st.checkbox("Marqueurs", value=True)
     with col_controls[3]:
         animate_route = st.checkbox("Animation", value=False)
+    with col_controls[4]:
+        show_road_segments = st.checkbox(
+            "Segments routiers",
+            value=segment_index is not None,
+            disabled=segment_index is None,
+            help="Une ligne par segment de route, moyennée sur toutes les sessions indexées"
+        )
     
     col1, col2 = st.columns([3, 1])
     
@@ -221,54 +748,47 @@ def render_interactive_map(df):
                 name=map_style
             ).add_to(m)
         
-        # Préparer les données de trajectoire avec gradient de couleur
-        points = []
-        for idx, row in df.iterrows():
-            speed = row['VehSpeed']
-            soc = row['HVBSOC']
-            temp = row['HVBTemp']
-            
-            # Couleur basée sur la vitesse
-            if speed < 20:
-                color = '#00ff00'  # Vert
-            elif speed < 40:
-                color = '#7fff00'  # Vert-jaune
-            elif speed < 60:
-                color = '#ffff00'  # Jaune
-            elif speed < 80:
-                color = '#ff8c00'  # Orange
-            else:
-                color = '#ff0000'  # Rouge
-            
-            points.append({
-                'lat': row['GPSLat'],
-                'lon': row['GPSLon'],
-                'speed': speed,
-                'soc': soc,
-                'temp': temp,
-                'color': color,
-                'time': row['Time'],
-                'index': idx
-            })
+        # Colonnes de la trajectoire (tableaux numpy, sans itération ligne à ligne)
+        lats = df['GPSLat'].to_numpy()
+        lons = df['GPSLon'].to_numpy()
+        speeds = df['VehSpeed'].to_numpy()
+        socs = df['HVBSOC'].to_numpy()
         
-        # Dessiner la trajectoire avec segments colorés
-        for i in range(len(points) - 1):
-            segment = [
-                [points[i]['lat'], points[i]['lon']],
-                [points[i+1]['lat'], points[i+1]['lon']]
+        # Dessiner les segments routiers agrégés (une ligne par segment)
+        if show_road_segments:
+            visible = segment_index[
+                (segment_index[['lat1', 'lat2']].max(axis=1) >= df['GPSLat'].min()) &
+                (segment_index[['lat1', 'lat2']].min(axis=1) <= df['GPSLat'].max()) &
+                (segment_index[['lon1', 'lon2']].max(axis=1) >= df['GPSLon'].min()) &
+                (segment_index[['lon1', 'lon2']].min(axis=1) <= df['GPSLon'].max())
             ]
-            
-            folium.PolyLine(
-                segment,
-                color=points[i]['color'],
-                weight=5,
-                opacity=0.8,
-                popup=f"Vitesse: {points[i]['speed']:.1f} km/h<br>SOC: {points[i]['soc']:.1f}%"
-            ).add_to(m)
+            for seg in visible.itertuples(index=False):
+                wh_per_km = f"{seg.wh_per_km:.0f} Wh/km" if pd.notna(seg.wh_per_km) else "n/d"
+                folium.PolyLine(
+                    [[seg.lat1, seg.lon1], [seg.lat2, seg.lon2]],
+                    color=speed_color(seg.mean_speed),
+                    weight=6,
+                    opacity=0.9,
+                    popup=f"{seg.name or seg.segment_id}<br>"
+                          f"Vitesse moy: {seg.mean_speed:.1f} km/h<br>"
+                          f"Consommation: {wh_per_km}<br>"
+                          f"Température moy: {seg.mean_temp:.1f}°C<br>"
+                          f"Sessions: {seg.sessions}"
+                ).add_to(m)
+        else:
+            # Dessiner la trajectoire avec segments colorés
+            for i in range(len(df) - 1):
+                folium.PolyLine(
+                    [[lats[i], lons[i]], [lats[i+1], lons[i+1]]],
+                    color=speed_color(speeds[i]),
+                    weight=5,
+                    opacity=0.8,
+                    popup=f"Vitesse: {speeds[i]:.1f} km/h<br>SOC: {socs[i]:.1f}%"
+                ).add_to(m)
         
         # Heatmap de vitesse
         if show_heatmap:
-            heat_data = [[p['lat'], p['lon'], p['speed']/100] for p in points]
+            heat_data = np.column_stack([lats, lons, speeds / 100]).tolist()
             HeatMap(
                 heat_data,
                 radius=15,
@@ -278,14 +798,17 @@ def render_interactive_map(df):
         
         # Marqueurs de points d'intérêt
         if show_markers:
+            start = df.iloc[0]
+            end = df.iloc[-1]
+            
             # Point de départ
             folium.Marker(
-                [points[0]['lat'], points[0]['lon']],
+                [start['GPSLat'], start['GPSLon']],
                 popup=folium.Popup(f"""
                     <b>🟢 Point de Départ</b><br>
-                    Vitesse: {points[0]['speed']:.1f} km/h<br>
-                    SOC: {points[0]['soc']:.1f}%<br>
-                    Température: {points[0]['temp']:.1f}°C
+                    Vitesse: {start['VehSpeed']:.1f} km/h<br>
+                    SOC: {start['HVBSOC']:.1f}%<br>
+                    Température: {start['HVBTemp']:.1f}°C
                 """, max_width=250),
                 icon=folium.Icon(color="green", icon="play", prefix='fa'),
                 tooltip="Point de départ"
@@ -293,52 +816,46 @@ def render_interactive_map(df):
             
             # Point d'arrivée
             folium.Marker(
-                [points[-1]['lat'], points[-1]['lon']],
+                [end['GPSLat'], end['GPSLon']],
                 popup=folium.Popup(f"""
                     <b>🔴 Point d'Arrivée</b><br>
-                    Vitesse: {points[-1]['speed']:.1f} km/h<br>
-                    SOC: {points[-1]['soc']:.1f}%<br>
-                    Température: {points[-1]['temp']:.1f}°C<br>
+                    Vitesse: {end['VehSpeed']:.1f} km/h<br>
+                    SOC: {end['HVBSOC']:.1f}%<br>
+                    Température: {end['HVBTemp']:.1f}°C<br>
                     <br>
-                    <b>Consommation totale:</b> {points[0]['soc'] - points[-1]['soc']:.1f}%
+                    <b>Consommation totale:</b> {start['HVBSOC'] - end['HVBSOC']:.1f}%
                 """, max_width=250),
                 icon=folium.Icon(color="red", icon="stop", prefix='fa'),
                 tooltip="Point d'arrivée"
             ).add_to(m)
             
-            # Trouver l'index de la vitesse maximale dans la liste de points
-            max_speed_value = max(p['speed'] for p in points)
-            max_speed_point = next(p for p in points if p['speed'] == max_speed_value)
+            # Point de vitesse maximale
+            max_speed_point = df.loc[df['VehSpeed'].idxmax()]
             
             folium.Marker(
-                [max_speed_point['lat'], max_speed_point['lon']],
+                [max_speed_point['GPSLat'], max_speed_point['GPSLon']],
                 popup=folium.Popup(f"""
                     <b>🏎️ Vitesse Maximale</b><br>
-                    Vitesse: {max_speed_point['speed']:.1f} km/h<br>
-                    SOC: {max_speed_point['soc']:.1f}%
+                    Vitesse: {max_speed_point['VehSpeed']:.1f} km/h<br>
+                    SOC: {max_speed_point['HVBSOC']:.1f}%
                 """, max_width=200),
                 icon=folium.Icon(color="orange", icon="bolt", prefix='fa'),
-                tooltip=f"Vitesse max: {max_speed_point['speed']:.1f} km/h"
+                tooltip=f"Vitesse max: {max_speed_point['VehSpeed']:.1f} km/h"
             ).add_to(m)
             
-            # Marqueurs de points de recharge (si SOC augmente)
-            try:
-                for i in range(1, len(points)):
-                    if points[i]['soc'] > points[i-1]['soc'] + 5:  # Augmentation significative
-                        folium.Marker(
-                            [points[i]['lat'], points[i]['lon']],
-                            popup=f"⚡ Recharge détectée<br>SOC: {points[i]['soc']:.1f}%",
-                            icon=folium.Icon(color="blue", icon="battery-full", prefix='fa'),
-                            tooltip="Point de recharge"
-                        ).add_to(m)
-            except:
-                pass  # Ignorer si erreur de détection de recharge
+            # Marqueurs de points de recharge (augmentation significative du SOC)
+            for i in np.flatnonzero(np.diff(socs) > 5) + 1:
+                folium.Marker(
+                    [lats[i], lons[i]],
+                    popup=f"⚡ Recharge détectée<br>SOC: {socs[i]:.1f}%",
+                    icon=folium.Icon(color="blue", icon="battery-full", prefix='fa'),
+                    tooltip="Point de recharge"
+                ).add_to(m)
         
         # Animation de la trajectoire
         if animate_route:
-            coords = [[p['lat'], p['lon']] for p in points]
             AntPath(
-                coords,
+                np.column_stack([lats, lons]).tolist(),
                 color='#ffffff',
                 weight=3,
                 opacity=0.8,
@@ -409,6 +926,8 @@ def render_interactive_map(df):
         """)
 
 def render_statistical_analysis(df):
+    import plotly.graph_objects as go
+    
     st.markdown("### 📊 Analyse Statistique Descriptive")
     
     # Sélection des paramètres principaux à analyser
@@ -551,6 +1070,9 @@ def render_statistical_analysis(df):
     st.plotly_chart(fig_corr, use_container_width=True)
 
 def render_advanced_charts(df, selected_params):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
     st.markdown("### 📊 Analyse Multi-Paramètres")
     
     # Graphique principal combiné
@@ -593,6 +1115,8 @@ def render_advanced_charts(df, selected_params):
     st.plotly_chart(fig, use_container_width=True)
 
 def render_energy_analysis(df):
+    import plotly.graph_objects as go
+    
     st.markdown("### ⚡ Analyse Énergétique Avancée")
     
     col1, col2 = st.columns(2)
@@ -675,35 +1199,51 @@ def main():
         df = load_data()
     
     # Sidebar avec filtres
-    time_range, selected_params, view_mode = create_sidebar(df)
+    time_range, selected_params, view_mode, show_map, show_stats = create_sidebar(df)
     
     # Filtrage des données
     filtered_df = df[(df['Time'] >= time_range[0]) & (df['Time'] <= time_range[1])]
     
-    # Métriques principales
-    render_hero_metrics(filtered_df)
+    # Pyramide rééchantillonnée : les graphiques lisent le niveau suffisant. Les
+    # statistiques (extrêmes, dispersion, quantiles) restent calculées sur le brut.
+    pyramid = build_pyramid(df)
+    chart_df = select_level(pyramid, filtered_df, time_range, CHART_MAX_POINTS)
     
-    st.markdown("---")
+    # Alertes (moteur de règles rejoué sur la session)
+    render_alert_panel(time_range)
     
-    # Carte interactive
-    render_interactive_map(filtered_df)
+    # Métriques principales
+    render_hero_metrics(filtered_df)
     
     st.markdown("---")
     
-    # Analyse statistique descriptive
-    render_statistical_analysis(filtered_df)
+    if show_map:
+        # Index des segments routiers (si un graphe routier local est disponible)
+        segment_index = None
+        if os.path.exists(ROAD_GRAPH_FILE):
+            with st.spinner('🛣️ Map-matching sur le graphe routier...'):
+                segment_index = build_road_segment_index(df, os.path.basename(DATA_FILE))
+        
+        # Carte interactive
+        render_interactive_map(filtered_df, segment_index)
+        
+        st.markdown("---")
     
-    st.markdown("---")
+    if show_stats:
+        # Analyse statistique descriptive
+        render_statistical_analysis(filtered_df)
+        
+        st.markdown("---")
     
     # Graphiques selon le mode sélectionné
     if view_mode == "Vue synthétique" or view_mode == "Vue détaillée":
         if selected_params:
-            render_advanced_charts(filtered_df, selected_params)
+            render_advanced_charts(chart_df, selected_params)
         else:
             st.warning("⚠️ Veuillez sélectionner au moins un paramètre à visualiser")
     
     if view_mode == "Analyse énergétique":
-        render_energy_analysis(filtered_df)
+        render_energy_analysis(chart_df)
     
     # Données brutes (optionnel)
     with st.expander("🔍 Afficher les données brutes"):
@@ -712,6 +1252,24 @@ def main():
             use_container_width=True,
             height=400
         )
+        
+        export_rate = st.selectbox(
+            "Résolution d'export",
+            options=[None] + list(EXPORT_RATES_HZ),
+            format_func=lambda r: "Brute" if r is None else f"{r:g} Hz",
+            help="Canaux alignés sur une grille fixe (moyenne par intervalle, interpolation des trous)"
+        )
+        # Le CSV n'est construit qu'à la demande, puis mis en cache par (résolution, plage)
+        export_key = (export_rate, tuple(time_range))
+        if st.button("📦 Préparer l'export CSV"):
+            st.session_state['export_key'] = export_key
+        if st.session_state.get('export_key') == export_key:
+            st.download_button(
+                "💾 Exporter en CSV",
+                data=build_export_csv(export_rate, tuple(time_range)),
+                file_name=f"telemetrie_{'brute' if export_rate is None else f'{export_rate:g}hz'}.csv",
+                mime="text/csv"
+            )
     
     # Footer
     st.markdown("---")
@@ -721,6 +1279,10 @@ def main():
             Powered by Streamlit & Plotly</p>
         </div>
     """, unsafe_allow_html=True)
+    
+    # Premier rendu terminé : préchargement des panneaux restants en arrière-plan
+    if STARTUP_MODE != 'eager':
+        start_background_prewarm()
 
 if __name__ == "__main__":
     main()